@@ -5,9 +5,9 @@ See the plan at .claude/plans/ for the full annotation format.
 """
 from __future__ import annotations
 
+import functools
 import os
 import shutil
-import stat
 import subprocess
 import sys
 import tempfile
@@ -17,19 +17,24 @@ import pytest
 from sybil import Document, Region, Sybil
 
 sys.path.insert(0, str(Path(__file__).resolve().parent / "scripts"))
-from snippet_parser import FENCE_RE, parse_pragmas
+from snippet_parser import iter_fences, shell_command
+
+# PATH does not change during a test session, so tool lookups are memoized.
+# Scripts are run through the resolved absolute path of ``sh`` as well, which
+# spares the child process a PATH search before exec.
+_which = functools.lru_cache(maxsize=None)(shutil.which)
 
 
 def shell_script_parser(document: Document):
     """Find ``sh`` code blocks containing ``# pragma: testrun`` and yield Regions."""
-    for m in FENCE_RE.finditer(document.text):
-        code = m.group(1)
-        if "# pragma: testrun" not in code:
+    if "# pragma: testrun" not in document.text:
+        return
+    for start, end, code, pragmas in iter_fences(document.text):
+        if "testrun" not in pragmas:
             continue
-        pragmas = parse_pragmas(code)
         yield Region(
-            start=m.start(),
-            end=m.end(),
+            start=start,
+            end=end,
             parsed={"code": code, "pragmas": pragmas},
             evaluator=evaluate_shell_script,
         )
@@ -42,33 +47,37 @@ def evaluate_shell_script(example):
 
     # Check tool requirements
     requires = pragmas.get("requires", "sh").split()
-    missing = [t for t in requires if not shutil.which(t)]
+    missing = [t for t in requires if not _which(t)]
     if missing:
         pytest.skip(f"missing: {', '.join(missing)}")
 
     timeout = int(pragmas.get("timeout", "60"))
     test_id = pragmas.get("testrun", "unnamed")
 
-    # Write to temp file and execute
-    fd, path = tempfile.mkstemp(suffix=".sh", prefix=f"sybil-{test_id}-")
+    # Each script gets its own scratch directory as cwd and TMPDIR, so
+    # snippets can run concurrently under pytest-xdist without colliding.
+    worker_id = os.environ.get("PYTEST_XDIST_WORKER", "gw0")
+    workdir = tempfile.mkdtemp(prefix=f"sybil-{worker_id}-{test_id}-")
+    # Small scripts are passed inline rather than via a temp file; stdin
+    # stays inherited so commands in the script cannot swallow its remainder.
     try:
-        with os.fdopen(fd, "w", encoding="utf-8") as f:
-            f.write(code)
-        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
-        result = subprocess.run(
-            ["sh", path],
-            timeout=timeout,
-        )
-        expected_rc = int(pragmas.get("exitcode", "0"))
-        if result.returncode != expected_rc:
-            raise AssertionError(
-                f"Script {test_id} exited with code {result.returncode}"
-                f" (expected {expected_rc})"
+        with shell_command(_which("sh") or "sh", code, f"sybil-{test_id}") as argv:
+            result = subprocess.run(
+                argv,
+                timeout=timeout,
+                cwd=workdir,
+                env={**os.environ, "TMPDIR": workdir},
             )
     except subprocess.TimeoutExpired:
         raise AssertionError(f"Script {test_id} timed out after {timeout}s")
     finally:
-        os.unlink(path)
+        shutil.rmtree(workdir, ignore_errors=True)
+    expected_rc = int(pragmas.get("exitcode", "0"))
+    if result.returncode != expected_rc:
+        raise AssertionError(
+            f"Script {test_id} exited with code {result.returncode}"
+            f" (expected {expected_rc})"
+        )
 
 
 pytest_collect_file = Sybil(
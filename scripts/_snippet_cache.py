@@ -0,0 +1,91 @@
+"""On-disk cache of parsed Markdown files.
+
+Parse results are pickled under ``.cache/snippets/`` and keyed by the file's
+path, modification time and size, so only files that changed since the last
+run are parsed again.  Editing any script in ``scripts/`` invalidates every
+entry, which keeps stale results from outliving a parser change.
+
+Used by ``snippet_parser`` (script blocks) and ``build-pdf.py`` (front matter
+and rendered sections).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+
+_SCRIPTS_DIR = Path(__file__).resolve().parent
+CACHE_DIR = _SCRIPTS_DIR.parent / ".cache" / "snippets"
+
+# Newest modification time among the parser sources themselves.
+_CODE_STAMP = max(
+    p.stat().st_mtime_ns for p in _SCRIPTS_DIR.iterdir() if p.is_file()
+)
+
+
+def _file_key(path: Path) -> str:
+    st = path.stat()
+    return f"{os.path.abspath(path)}|{st.st_mtime_ns}-{st.st_size}"
+
+
+def _cache_file(path: Path, kind: str) -> Path:
+    key = f"{kind}|{_file_key(path)}|{_CODE_STAMP}"
+    return CACHE_DIR / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.pkl"
+
+
+def fingerprint(paths: Iterable[Path]) -> str:
+    """Return a digest identifying the current state of *paths*, in order.
+
+    Like cache keys, it changes when any file's mtime or size changes, or
+    when the scripts themselves are edited.
+    """
+    h = hashlib.sha1(str(_CODE_STAMP).encode("utf-8"))
+    for path in paths:
+        h.update(f"\0{_file_key(path)}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def write_atomic(dest: Path, data: bytes) -> None:
+    """Write *data* to *dest* via a temporary file and rename.
+
+    Failures to write (e.g. a read-only checkout) are silently ignored.
+    """
+    try:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dest.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, dest)
+    except OSError:
+        pass
+
+
+def lookup(path: Path, kind: str) -> Any | None:
+    """Return the cached *kind* parse result for *path*, or ``None``."""
+    try:
+        return pickle.loads(_cache_file(path, kind).read_bytes())
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def store(path: Path, kind: str, value: Any) -> None:
+    """Cache *value* as the *kind* parse result for *path*."""
+    try:
+        cache_file = _cache_file(path, kind)
+    except OSError:
+        return
+    write_atomic(cache_file, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def load_or_parse(path: Path, kind: str, parse: Callable[[Path], T]) -> T:
+    """Return ``parse(path)``, reusing a cached result if *path* is unchanged."""
+    value = lookup(path, kind)
+    if value is None:
+        value = parse(path)
+        store(path, kind, value)
+    return value
@@ -11,38 +11,39 @@ This is a scaffold.  Look for TODO comments for planned enhancements.
 from __future__ import annotations
 
 import argparse
-import re
+import os
 import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterator
+
+try:
+    import frontmatter
+except ImportError:
+    sys.exit(
+        "build-pdf.py requires python-frontmatter; install it with\n"
+        "  pip install -r requirements-pdf.txt"
+    )
+
+import _snippet_cache
 
 
-# TODO: Replace this minimal parser with python-frontmatter for robustness.
-def parse_front_matter(text: str) -> tuple[dict, str]:
+def parse_front_matter(text: str | bytes) -> tuple[dict, str]:
     """Extract YAML front matter and body from a Markdown file.
 
-    Returns a (metadata_dict, body_string) tuple.  The parser is intentionally
-    minimal -- it handles the common ``---`` delimited front matter only.
+    Returns a (metadata_dict, body_string) tuple.  Parsing is delegated to
+    python-frontmatter, which uses PyYAML (with the LibYAML C loader when
+    available).  *text* may be undecoded UTF-8 bytes.
     """
-    match = re.match(r"^---\s*\n(.*?)\n---\s*\n(.*)", text, re.DOTALL)
-    if not match:
-        return {}, text
-
-    meta: dict = {}
-    for line in match.group(1).splitlines():
-        if ":" in line:
-            key, _, value = line.partition(":")
-            value = value.strip().strip('"').strip("'")
-            # Primitive list detection (e.g. "[a, b, c]")
-            if value.startswith("[") and value.endswith("]"):
-                value = [v.strip().strip('"').strip("'") for v in value[1:-1].split(",")]
-            meta[key.strip()] = value
-
-    return meta, match.group(2)
+    post = frontmatter.loads(text)
+    return post.metadata, post.content
 
 
 # Canonical ordering for STAMPED principles.
 # Keys are the single-letter codes used in front matter; values are full names.
 STAMPED_ORDER = ["S", "T", "A", "M", "P", "E", "D"]
+_STAMPED_SET = frozenset(STAMPED_ORDER)
 STAMPED_NAMES = {
     "S": "Self-containment",
     "T": "Tracking",
@@ -54,72 +55,125 @@ STAMPED_NAMES = {
 }
 
 
+def iter_markdown_paths(root: str | os.PathLike) -> Iterator[str]:
+    """Yield paths of Markdown files anywhere under *root*.
+
+    Hugo section index files (``_index.md``) are skipped.  Symlinked
+    directories are not followed.
+    """
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            if name.endswith(".md") and name != "_index.md":
+                yield os.path.join(dirpath, name)
+
+
 def discover_examples(content_dir: Path) -> list[tuple[dict, str, Path]]:
-    """Find all Markdown example files and return (meta, body, path) triples."""
-    examples = []
-    for md_path in sorted(content_dir.rglob("*.md")):
-        # Skip Hugo section index files.
-        if md_path.name == "_index.md":
-            continue
-        text = md_path.read_text(encoding="utf-8")
-        meta, body = parse_front_matter(text)
-        examples.append((meta, body, md_path))
-    return examples
+    """Find all Markdown example files and return (meta, body, path) triples.
+
+    Parse results of unchanged files are reused from the on-disk cache.  The
+    remaining files are read concurrently to overlap I/O latency; parsing
+    happens serially in the calling thread.
+    """
+    paths = sorted(map(Path, iter_markdown_paths(content_dir)))
+    parsed = {p: _snippet_cache.lookup(p, "front-matter") for p in paths}
+    missing = [p for p, value in parsed.items() if value is None]
+    if missing:
+        workers = min(32, (os.cpu_count() or 1) * 4, len(missing))
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            raw = list(ex.map(Path.read_bytes, missing))
+        for md_path, data in zip(missing, raw):
+            parsed[md_path] = parse_front_matter(data)
+            _snippet_cache.store(md_path, "front-matter", parsed[md_path])
+
+    return [(*parsed[md_path], md_path) for md_path in paths]
 
 
 def group_by_stamped(
     examples: list[tuple[dict, str, Path]],
 ) -> dict[str, list[tuple[dict, str, Path]]]:
     """Group examples by their primary STAMPED principle."""
-    groups: dict[str, list[tuple[dict, str, Path]]] = {
-        p: [] for p in STAMPED_ORDER
-    }
-    groups["Other"] = []
+    groups: dict[str, list[tuple[dict, str, Path]]] = defaultdict(list)
 
     for meta, body, path in examples:
-        principles = meta.get("stamped_principles", [])
+        # An empty key parses to None; entries may be any YAML scalar.
+        principles = meta.get("stamped_principles") or []
         if isinstance(principles, str):
             principles = [principles]
 
-        placed = False
         for p in principles:
+            if not isinstance(p, str):
+                continue
+            # Quoted YAML scalars keep surrounding whitespace.
             letter = p.strip().upper()
-            if letter in STAMPED_ORDER:
+            if letter in _STAMPED_SET:
                 groups[letter].append((meta, body, path))
-                placed = True
                 break
-        if not placed:
+        else:
             groups["Other"].append((meta, body, path))
 
     return groups
 
 
-def build_combined_markdown(groups: dict[str, list[tuple[dict, str, Path]]]) -> str:
-    """Concatenate grouped examples into a single Markdown document."""
-    parts: list[str] = []
-    parts.append("---")
-    parts.append("title: STAMPED Principles Examples Collection")
-    parts.append("---\n")
+def render_group(principle: str, entries: list[tuple[dict, str, Path]]) -> str:
+    """Render the Markdown section for one principle group."""
+    name = STAMPED_NAMES.get(principle, principle)
+    heading = f"{principle} -- {name}" if principle in STAMPED_NAMES else principle
+    parts = [f"\n# {heading}\n"]
+
+    for meta, body, path in entries:
+        title = meta.get("title", path.stem.replace("-", " ").title())
+        parts.append(f"\n## {title}\n")
 
-    for principle in STAMPED_ORDER + ["Other"]:
-        entries = groups.get(principle, [])
-        if not entries:
-            continue
+        # TODO: Render tools / difficulty / verified metadata here.
 
-        name = STAMPED_NAMES.get(principle, principle)
-        heading = f"{principle} -- {name}" if principle in STAMPED_NAMES else principle
-        parts.append(f"# {heading}\n")
+        parts.append("\n")
+        parts.append(body.strip())
+        parts.append("\n\n\\newpage\n")
 
-        for meta, body, path in entries:
-            title = meta.get("title", path.stem.replace("-", " ").title())
-            parts.append(f"## {title}\n")
+    return "".join(parts)
 
-            # TODO: Render tools / difficulty / verified metadata here.
 
-            parts.append(body.strip())
-            parts.append("\n\\newpage\n")
+def cached_group(principle: str, entries: list[tuple[dict, str, Path]]) -> str:
+    """Return :func:`render_group` output, reusing a cached chunk if possible.
 
-    return "\n".join(parts)
+    Chunks live in ``.cache/pdf-chunks/`` (next to the snippet cache, resolved
+    at call time) and are keyed by the mtime and size of every file in the
+    group; outdated chunks of the group are removed.
+    """
+    chunk_dir = _snippet_cache.CACHE_DIR.parent / "pdf-chunks"
+    digest = _snippet_cache.fingerprint(path for _, _, path in entries)
+    chunk = chunk_dir / f"{principle}-{digest}.md"
+    try:
+        return chunk.read_text(encoding="utf-8")
+    except OSError:
+        pass
+
+    text = render_group(principle, entries)
+    for stale in chunk_dir.glob(f"{principle}-*.md"):
+        try:
+            stale.unlink()
+        except OSError:
+            pass
+    _snippet_cache.write_atomic(chunk, text.encode("utf-8"))
+    return text
+
+
+def write_combined_markdown(
+    groups: dict[str, list[tuple[dict, str, Path]]],
+    out_path: Path,
+) -> None:
+    """Write grouped examples to *out_path* as a single Markdown document.
+
+    Sections are streamed through a buffered file handle one group at a
+    time instead of being joined in memory first.
+    """
+    with out_path.open("w", encoding="utf-8", buffering=1 << 20) as f:
+        f.write("---\ntitle: STAMPED Principles Examples Collection\n---\n")
+
+        for principle in STAMPED_ORDER + ["Other"]:
+            entries = groups.get(principle, [])
+            if entries:
+                f.write(cached_group(principle, entries))
 
 
 def main() -> None:
@@ -154,9 +208,7 @@ def main() -> None:
         sys.exit(0)
 
     groups = group_by_stamped(examples)
-    combined = build_combined_markdown(groups)
-
-    args.output.write_text(combined, encoding="utf-8")
+    write_combined_markdown(groups, args.output)
     print(f"Wrote combined Markdown to {args.output}  ({len(examples)} examples)")
 
     # Print pandoc instructions.
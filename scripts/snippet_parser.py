@@ -1,22 +1,58 @@
 """Shared parsing utilities for shell script snippets in Markdown examples.
 
-Extracts fenced ``sh``/``bash`` code blocks and their ``# pragma:`` annotations.
+Extracts fenced ``sh``/``bash`` code blocks and their ``# pragma:`` annotations,
+and builds the command line that runs one.
 Used by both ``conftest.py`` (Sybil test runner) and ``materialize_examples``
 (branch materializer).
 """
 from __future__ import annotations
 
+import contextlib
+import os
 import re
+import tempfile
+import warnings
 from pathlib import Path
-from typing import Iterator, NamedTuple
+from typing import Iterable, Iterator, NamedTuple
 
-# Regex: fenced code block with sh or bash language tag.
-# Captures the code content between the opening and closing fences.
-FENCE_RE = re.compile(
-    r"^```(?:sh|bash)\s*\n(.*?)^```",
-    re.MULTILINE | re.DOTALL,
+import _snippet_cache
+
+# Pragma keys understood by conftest.py and materialize_examples.
+KNOWN_PRAGMAS = frozenset({"testrun", "requires", "timeout", "exitcode", "materialize"})
+
+# A whole "# pragma: key value" line, e.g. "# pragma: testrun scenario-1".
+# ``[^\S\n]`` is whitespace that cannot run on into the next line.
+_PRAGMA_RE = re.compile(
+    r"^[^\S\n]*# pragma:[^\S\n]+(\S+)(?:[^\S\n]+(.*?))?[^\S\n]*$",
+    re.MULTILINE,
 )
 
+# Opening line of any fenced code block: a run of 3+ backticks or tildes
+# followed by an optional info string (the language tag).
+_FENCE_OPEN_RE = re.compile(r"(`{3,}|~{3,})(.*)")
+
+# Info strings that mark a block as a shell script.
+SHELL_LANGS = frozenset({"sh", "bash"})
+
+
+def _pragma_dict(pairs: Iterable[tuple[str, str]]) -> dict[str, str | list[str]]:
+    """Build a pragma mapping from ``(key, value)`` pairs in script order.
+
+    Keys outside :data:`KNOWN_PRAGMAS` are dropped with a warning, so that
+    typos such as ``# pragma: timout`` do not go unnoticed.
+    """
+    pragmas: dict[str, str | list[str]] = {}
+    for key, value in pairs:
+        if key not in KNOWN_PRAGMAS:
+            warnings.warn(f"ignoring unknown pragma {key!r}", stacklevel=3)
+        elif key == "materialize":
+            pragmas.setdefault("materialize", [])
+            assert isinstance(pragmas["materialize"], list)
+            pragmas["materialize"].append(value)
+        else:
+            pragmas[key] = value
+    return pragmas
+
 
 def parse_pragmas(code: str) -> dict[str, str | list[str]]:
     """Extract ``# pragma: key value`` directives from script text.
@@ -24,22 +60,66 @@ def parse_pragmas(code: str) -> dict[str, str | list[str]]:
     Most keys map to a single string value.  ``materialize`` may appear
     multiple times and is always returned as a list.
     """
-    pragmas: dict[str, str | list[str]] = {}
-    for line in code.splitlines():
-        stripped = line.strip()
-        if stripped.startswith("# pragma:"):
-            # e.g. "# pragma: testrun scenario-1"
-            parts = stripped.split(None, 3)  # ['#', 'pragma:', key, value...]
-            if len(parts) >= 3:
-                key = parts[2]
-                value = parts[3] if len(parts) > 3 else ""
-                if key == "materialize":
-                    pragmas.setdefault("materialize", [])
-                    assert isinstance(pragmas["materialize"], list)
-                    pragmas["materialize"].append(value)
-                else:
-                    pragmas[key] = value
-    return pragmas
+    if "# pragma:" not in code:
+        return {}
+    return _pragma_dict(_PRAGMA_RE.findall(code))
+
+
+def iter_fences(
+    text: str,
+) -> Iterator[tuple[int, int, str, dict[str, str | list[str]]]]:
+    """Yield ``(start, end, code, pragmas)`` for each ``sh``/``bash`` block.
+
+    *start* and *end* are offsets of the opening fence and of the end of the
+    closing fence in *text*; *code* is the content between them and
+    *pragmas* is what :func:`parse_pragmas` would return for it, collected
+    during the same pass.  The text is scanned line by line with explicit
+    fence state, so the cost stays linear even for unterminated fences.
+    Blocks in other languages are tracked as well, so shell examples nested
+    inside them are not yielded.
+    """
+    fence = ""  # opening fence run of the block we are inside, if any
+    is_shell = False
+    start = body_start = 0
+    pairs: list[tuple[str, str]] = []
+    # Offsets of the next "\n```" and "\n~~~" (-1 once none remain).
+    next_bt, next_tl = text.find("\n```"), text.find("\n~~~")
+    pos = 0
+    size = len(text)
+    while pos < size:
+        if not is_shell and not text.startswith(("```", "~~~"), pos):
+            # Outside shell blocks only fence lines matter: jump straight to
+            # the next line starting with ``` or ~~~ using plain str.find.
+            if 0 <= next_bt < pos:
+                next_bt = text.find("\n```", pos)
+            if 0 <= next_tl < pos:
+                next_tl = text.find("\n~~~", pos)
+            if next_bt < 0 and next_tl < 0:
+                break
+            pos = min(i for i in (next_bt, next_tl) if i >= 0) + 1
+            continue
+        nl = text.find("\n", pos)
+        line_end = size if nl < 0 else nl + 1
+        line = text[pos:line_end].rstrip()
+        if not fence:
+            m = _FENCE_OPEN_RE.match(line)
+            if m:
+                fence = m.group(1)
+                is_shell = m.group(2).strip() in SHELL_LANGS
+                start, body_start = pos, line_end
+                pairs = []
+        elif len(line) >= len(fence) and not line.strip(fence[0]):
+            # Closing fence: same character, at least as long as the opener.
+            if is_shell:
+                code = text[body_start:pos]
+                yield start, pos + len(line), code, _pragma_dict(pairs)
+            fence = ""
+            is_shell = False
+        elif is_shell and "# pragma:" in line:
+            m = _PRAGMA_RE.match(line)
+            if m:
+                pairs.append((m.group(1), m.group(2) or ""))
+        pos = line_end
 
 
 class ScriptBlock(NamedTuple):
@@ -50,17 +130,78 @@ class ScriptBlock(NamedTuple):
     file_stem: str
 
 
+def _parse_script_blocks(md_path: Path) -> tuple[list[ScriptBlock], list[str]]:
+    """Return the testrun blocks of *md_path* and any parser warnings.
+
+    The warning messages (e.g. unknown pragmas) are returned rather than
+    emitted so that they are cached along with the blocks.
+    """
+    raw = md_path.read_bytes()
+    # Cheap substring check first, before decoding: most files have no
+    # testrun blocks.
+    if b"# pragma: testrun" not in raw:
+        return [], []
+    # Same newline translation as read_text() would apply.
+    text = raw.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        blocks = [
+            ScriptBlock(code=code, pragmas=pragmas, file_stem=md_path.stem)
+            for _start, _end, code, pragmas in iter_fences(text)
+            if "testrun" in pragmas
+        ]
+    return blocks, [str(w.message) for w in caught]
+
+
+# In-process layer over the disk cache, keyed like it by absolute path,
+# mtime_ns and size.
+_PARSE_CACHE: dict[tuple[str, int, int], tuple[list[ScriptBlock], list[str]]] = {}
+
+
 def iter_script_blocks(md_path: str | Path) -> Iterator[ScriptBlock]:
     """Yield :class:`ScriptBlock` instances from a Markdown file.
 
-    Only blocks containing ``# pragma: testrun`` are yielded.
+    Only blocks containing ``# pragma: testrun`` are yielded.  Results are
+    cached in memory and on disk (see :mod:`_snippet_cache`) until the file
+    changes; parser warnings such as unknown pragmas are cached with them
+    and repeated on every call.
     """
     md_path = Path(md_path)
-    text = md_path.read_text(encoding="utf-8")
-    file_stem = md_path.stem
-    for m in FENCE_RE.finditer(text):
-        code = m.group(1)
-        if "# pragma: testrun" not in code:
-            continue
-        pragmas = parse_pragmas(code)
-        yield ScriptBlock(code=code, pragmas=pragmas, file_stem=file_stem)
+    st = md_path.stat()
+    key = (os.path.abspath(md_path), st.st_mtime_ns, st.st_size)
+    parsed = _PARSE_CACHE.get(key)
+    if parsed is None:
+        parsed = _snippet_cache.load_or_parse(
+            md_path, "script-blocks", _parse_script_blocks,
+        )
+        _PARSE_CACHE[key] = parsed
+    blocks, messages = parsed
+    for message in messages:
+        warnings.warn(f"{md_path}: {message}", stacklevel=2)
+    yield from blocks
+
+
+# Linux caps each argv string at MAX_ARG_STRLEN (128 KiB), so scripts larger
+# than this are run from a temporary file instead of being passed to -c.
+INLINE_SCRIPT_MAX = 64 * 1024
+
+
+@contextlib.contextmanager
+def shell_command(sh: str, code: str, name: str) -> Iterator[list[str]]:
+    """Yield an argv that runs *code* with the shell *sh*.
+
+    The script is passed inline as ``sh -c code name`` when it fits in
+    :data:`INLINE_SCRIPT_MAX` bytes; otherwise it is written to a temporary
+    file, which is removed on exit.  Either way the script's stdin is left
+    to the caller.
+    """
+    if len(code.encode("utf-8")) <= INLINE_SCRIPT_MAX:
+        yield [sh, "-c", code, name]
+        return
+    fd, path = tempfile.mkstemp(suffix=".sh", prefix=f"{name}-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(code)
+        yield [sh, path]
+    finally:
+        os.unlink(path)
@@ -0,0 +1,93 @@
+"""Tests for scripts/build-pdf.py."""
+from __future__ import annotations
+
+import importlib.util
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+_SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+sys.path.insert(0, str(_SCRIPTS_DIR))
+
+import _snippet_cache
+
+
+@pytest.fixture(scope="session")
+def build_pdf_mod():
+    spec = importlib.util.spec_from_file_location(
+        "build_pdf", _SCRIPTS_DIR / "build-pdf.py",
+    )
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+@pytest.fixture(autouse=True)
+def _isolated_cache(tmp_path, monkeypatch):
+    """Keep parse results and PDF chunks out of the repository's cache."""
+    monkeypatch.setattr(_snippet_cache, "CACHE_DIR", tmp_path / ".cache" / "snippets")
+
+
+def _write_example(path: Path, principles: str, body: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        f"---\ntitle: {path.stem}\nstamped_principles: {principles}\n---\n{body}\n"
+    )
+
+
+def _build(mod, content_dir: Path, out: Path) -> str:
+    mod.write_combined_markdown(
+        mod.group_by_stamped(mod.discover_examples(content_dir)), out,
+    )
+    return out.read_text()
+
+
+class TestGroupByStamped:
+    def test_first_known_principle_wins(self, build_pdf_mod):
+        groups = build_pdf_mod.group_by_stamped(
+            [({"stamped_principles": ["x", "t", "S"]}, "", Path("a.md"))]
+        )
+        assert list(groups) == ["T"]
+
+    def test_quoted_principle_is_stripped(self, build_pdf_mod):
+        groups = build_pdf_mod.group_by_stamped(
+            [({"stamped_principles": [" s"]}, "", Path("a.md"))]
+        )
+        assert list(groups) == ["S"]
+
+    def test_empty_or_untyped_principles_go_to_other(self, build_pdf_mod):
+        examples = [
+            ({"stamped_principles": None}, "", Path("a.md")),
+            ({"stamped_principles": [None, 1]}, "", Path("b.md")),
+            ({}, "", Path("c.md")),
+        ]
+        groups = build_pdf_mod.group_by_stamped(examples)
+        assert list(groups) == ["Other"]
+        assert len(groups["Other"]) == 3
+
+
+class TestCachedGroup:
+    def test_only_changed_group_is_rendered(self, build_pdf_mod, tmp_path):
+        content = tmp_path / "examples"
+        _write_example(content / "a.md", '["S"]', "first body")
+        _write_example(content / "b.md", '["T"]', "other body")
+        out = tmp_path / "out.md"
+        chunk_dir = tmp_path / ".cache" / "pdf-chunks"
+
+        assert "first body" in _build(build_pdf_mod, content, out)
+        [old_chunk] = chunk_dir.glob("S-*.md")
+
+        _write_example(content / "a.md", '["S"]', "second, longer body")
+        with patch.object(
+            build_pdf_mod, "render_group", wraps=build_pdf_mod.render_group,
+        ) as render:
+            text = _build(build_pdf_mod, content, out)
+
+        assert "second, longer body" in text
+        assert "first body" not in text
+        assert "other body" in text
+        assert [c.args[0] for c in render.call_args_list] == ["S"]
+        assert not old_chunk.exists()
+        assert len(list(chunk_dir.glob("S-*.md"))) == 1
@@ -5,8 +5,10 @@ Covers snippet_parser, materialize_examples, and dematerialize_examples.
 from __future__ import annotations
 
 import os
+import shutil
 import subprocess
 import textwrap
+import time
 from pathlib import Path
 from unittest.mock import patch
 
@@ -18,7 +20,15 @@ import sys
 _REPO_ROOT = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(_REPO_ROOT / "scripts"))
 
-from snippet_parser import FENCE_RE, ScriptBlock, iter_script_blocks, parse_pragmas
+import _snippet_cache
+import snippet_parser
+from snippet_parser import (
+    ScriptBlock,
+    iter_fences,
+    iter_script_blocks,
+    parse_pragmas,
+    shell_command,
+)
 
 # Import the scripts (no .py extension) using importlib.util
 import importlib.machinery
@@ -28,20 +38,60 @@ _SCRIPTS_DIR = _REPO_ROOT / "scripts"
 
 
 def _load_script(name: str):
-    path = _SCRIPTS_DIR / name
-    spec = importlib.util.spec_from_loader(
-        name,
-        importlib.machinery.SourceFileLoader(name, str(path)),
-        origin=str(path),
+    """Import the extension-less script *name* from ``scripts/`` once.
+
+    The module is registered in :data:`sys.modules`, so repeated loads reuse
+    it, and CPython's bytecode cache spares recompiling it on later runs.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    path = str(_SCRIPTS_DIR / name)
+    spec = importlib.util.spec_from_file_location(
+        name, path, loader=importlib.machinery.SourceFileLoader(name, path),
     )
     mod = importlib.util.module_from_spec(spec)
-    mod.__file__ = str(path)
-    spec.loader.exec_module(mod)
+    sys.modules[name] = mod
+    try:
+        spec.loader.exec_module(mod)
+    except BaseException:
+        del sys.modules[name]
+        raise
     return mod
 
 
-materialize_mod = _load_script("materialize_examples")
-dematerialize_mod = _load_script("dematerialize_examples")
+# The scripts are loaded on first use, so tests that only need
+# snippet_parser never execute their top-level code.
+@pytest.fixture(scope="session")
+def materialize_mod():
+    return _load_script("materialize_examples")
+
+
+@pytest.fixture(scope="session")
+def dematerialize_mod():
+    return _load_script("dematerialize_examples")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _isolated_git_env(tmp_path_factory):
+    """Keep git from reading user/system config or copying hook templates.
+
+    Applies to every ``git`` spawned by these tests, including those inside
+    the materialized example scripts.
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("GIT_CONFIG_GLOBAL", os.devnull)
+        mp.setenv("GIT_CONFIG_SYSTEM", os.devnull)
+        mp.setenv("GIT_TEMPLATE_DIR", str(tmp_path_factory.mktemp("git-template")))
+        mp.setenv("HOME", str(tmp_path_factory.mktemp("home")))
+        yield
+
+
+@pytest.fixture(autouse=True)
+def _isolated_snippet_cache(tmp_path_factory, monkeypatch):
+    """Keep parse results of test files out of the repository's cache."""
+    monkeypatch.setattr(
+        _snippet_cache, "CACHE_DIR", tmp_path_factory.mktemp("snippet-cache"),
+    )
 
 
 # ---------------------------------------------------------------------------
@@ -92,23 +142,67 @@ class TestParsePragmas:
         result = parse_pragmas(code)
         assert result["testrun"] == ""
 
+    def test_unknown_pragma_warns(self):
+        code = "# pragma: testrun s1\n# pragma: timout 10\n"
+        with pytest.warns(UserWarning, match="timout"):
+            result = parse_pragmas(code)
+        assert result == {"testrun": "s1"}
 
-class TestFenceRe:
+
+class TestIterFences:
     def test_matches_sh_block(self):
         md = "text\n```sh\necho hello\n```\nmore text\n"
-        matches = list(FENCE_RE.finditer(md))
-        assert len(matches) == 1
-        assert "echo hello" in matches[0].group(1)
-
-    def test_matches_bash_block(self):
-        md = "text\n```bash\necho hello\n```\n"
-        matches = list(FENCE_RE.finditer(md))
-        assert len(matches) == 1
-
-    def test_skips_other_languages(self):
-        md = "```python\nprint('hi')\n```\n"
-        matches = list(FENCE_RE.finditer(md))
-        assert len(matches) == 0
+        fences = list(iter_fences(md))
+        assert len(fences) == 1
+        start, end, code, pragmas = fences[0]
+        assert code == "echo hello\n"
+        assert pragmas == {}
+        assert md[start:end] == "```sh\necho hello\n```"
+
+    def test_tilde_and_long_fences(self):
+        md = "~~~bash\necho a\n~~~\n\n````sh\n```\necho b\n````\n"
+        codes = [code for _, _, code, _ in iter_fences(md)]
+        assert codes == ["echo a\n", "```\necho b\n"]
+
+    def test_collects_pragmas(self):
+        md = textwrap.dedent("""\
+            ```sh
+            # pragma: testrun demo-1
+            # pragma: materialize a
+            # pragma: materialize b
+            echo hello
+            ```
+        """)
+        (_, _, code, pragmas), = iter_fences(md)
+        assert pragmas == parse_pragmas(code)
+        assert pragmas["materialize"] == ["a", "b"]
+
+    def test_skips_blocks_nested_in_other_languages(self):
+        md = "````markdown\n```sh\necho nested\n```\n````\n"
+        assert list(iter_fences(md)) == []
+
+    def test_unterminated_fence(self):
+        md = "```sh\necho hello\n"
+        assert list(iter_fences(md)) == []
+
+    def test_pathological_input_scales_linearly(self):
+        def best_time(md: str) -> float:
+            times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                list(iter_fences(md))
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        for make in [
+            lambda n: "```sh\n" + "`" * n + "\n```",
+            lambda n: "```sh" + "\n" * n,
+            lambda n: "```sh\n" * n,
+        ]:
+            small, large = best_time(make(20000)), best_time(make(80000))
+            # 4x the input: ~4x the time if linear, ~16x if quadratic.  The
+            # constant absorbs timer noise on inputs that parse in microseconds.
+            assert large < 8 * small + 0.005
 
 
 class TestIterScriptBlocks:
@@ -140,6 +234,64 @@ class TestIterScriptBlocks:
         blocks = list(iter_script_blocks(md))
         assert blocks[0].file_stem == "stamped-awk-evolution"
 
+    def test_skips_files_without_testrun(self, tmp_path):
+        # Not valid UTF-8: only passes if the prefilter runs before decoding.
+        md = tmp_path / "example.md"
+        md.write_bytes(b"\xff```sh\necho hi\n```\n")
+        assert list(iter_script_blocks(md)) == []
+
+    def test_cache_reflects_file_changes(self, tmp_path):
+        md = tmp_path / "example.md"
+        md.write_text("```sh\n# pragma: testrun s1\necho hi\n```\n")
+        assert list(iter_script_blocks(md))[0].pragmas["testrun"] == "s1"
+        assert list(_snippet_cache.CACHE_DIR.iterdir())
+
+        md.write_text("```sh\n# pragma: testrun s22\necho hi\n```\n")
+        assert list(iter_script_blocks(md))[0].pragmas["testrun"] == "s22"
+
+    def test_unknown_pragma_warns_on_cached_parses(self, tmp_path):
+        md = tmp_path / "example.md"
+        md.write_text("```sh\n# pragma: testrun s1\n# pragma: timout 5\n```\n")
+        # Fresh parse, then a disk-cache hit, then an in-memory hit.
+        for clear_memory in (False, True, False):
+            if clear_memory:
+                snippet_parser._PARSE_CACHE.clear()
+            with pytest.warns(UserWarning, match="timout"):
+                list(iter_script_blocks(md))
+
+    def test_relative_paths_keyed_by_location(self, tmp_path, monkeypatch):
+        for name, testrun in [("a", "s1"), ("b", "s2")]:
+            md = tmp_path / name / "example.md"
+            md.parent.mkdir()
+            md.write_text(f"```sh\n# pragma: testrun {testrun}\necho hi\n```\n")
+            os.utime(md, ns=(0, 0))
+        for name, testrun in [("a", "s1"), ("b", "s2")]:
+            monkeypatch.chdir(tmp_path / name)
+            blocks = list(iter_script_blocks("example.md"))
+            assert blocks[0].pragmas["testrun"] == testrun
+
+    def test_repeat_parse_skips_disk_cache(self, tmp_path):
+        md = tmp_path / "example.md"
+        md.write_text("```sh\n# pragma: testrun s1\necho hi\n```\n")
+        first = list(iter_script_blocks(md))
+        with patch.object(_snippet_cache, "load_or_parse") as load:
+            assert list(iter_script_blocks(md)) == first
+        load.assert_not_called()
+
+
+class TestShellCommand:
+    def test_small_script_inline(self):
+        with shell_command("sh", "echo hi\n", "snippet") as argv:
+            assert argv == ["sh", "-c", "echo hi\n", "snippet"]
+
+    def test_large_script_runs_from_file(self):
+        code = "echo ok\n" + "#" * 200_000 + "\n"
+        with shell_command("sh", code, "snippet") as argv:
+            assert len(argv) == 2
+            result = subprocess.run(argv, capture_output=True, text=True)
+        assert result.stdout == "ok\n"
+        assert not Path(argv[1]).exists()
+
 
 # ---------------------------------------------------------------------------
 # Unit tests: materialize_examples
@@ -147,13 +299,13 @@ class TestIterScriptBlocks:
 
 
 class TestBranchName:
-    def test_basic(self):
+    def test_basic(self, materialize_mod):
         result = materialize_mod.branch_name(
             "stamped-awk-evolution", "scenario-2", "grocery-analysis"
         )
         assert result == "examples/stamped-awk-evolution/scenario-2/grocery-analysis"
 
-    def test_multiple_repos(self):
+    def test_multiple_repos(self, materialize_mod):
         b1 = materialize_mod.branch_name(
             "stamped-awk-evolution", "scenario-4", "grocery-analysis"
         )
@@ -166,26 +318,37 @@ class TestBranchName:
 
 
 class TestScriptHash:
-    def test_deterministic(self):
+    def test_deterministic(self, materialize_mod):
         code = "echo hello\n"
         h1 = materialize_mod.script_hash(code)
         h2 = materialize_mod.script_hash(code)
         assert h1 == h2
-        assert len(h1) == 64  # SHA-256 hex digest
+        assert len(h1) == 64  # BLAKE2b-256 hex digest
 
-    def test_different_content(self):
+    def test_different_content(self, materialize_mod):
         h1 = materialize_mod.script_hash("echo hello\n")
         h2 = materialize_mod.script_hash("echo world\n")
         assert h1 != h2
 
 
+class TestExecuteScript:
+    def test_large_script(self, materialize_mod):
+        code = 'mkdir "$TMPDIR/made"\n' + "#" * 200_000 + "\n"
+        block = ScriptBlock(code=code, pragmas={"testrun": "big"}, file_stem="x")
+        tmpdir = materialize_mod.execute_script(block, strict=False)
+        try:
+            assert (tmpdir / "made").is_dir()
+        finally:
+            shutil.rmtree(tmpdir)
+
+
 class TestDetectRemoteUrl:
-    def test_github_env(self):
+    def test_github_env(self, materialize_mod):
         with patch.dict(os.environ, {"GITHUB_REPOSITORY": "myyoda/principles-examples"}):
             url = materialize_mod.detect_remote_url("origin")
             assert url == "https://github.com/myyoda/principles-examples"
 
-    def test_git_remote(self):
+    def test_git_remote(self, materialize_mod):
         with patch.dict(os.environ, {}, clear=True):
             env = {k: v for k, v in os.environ.items() if k != "GITHUB_REPOSITORY"}
             with patch.dict(os.environ, env, clear=True):
@@ -197,45 +360,27 @@ class TestDetectRemoteUrl:
                     assert url == "git@github.com:foo/bar.git"
 
 
+@pytest.fixture(scope="session")
+def _gitmodules_repo(tmp_path_factory) -> Path:
+    """A repo with a committed relative-URL ``.gitmodules``, built once."""
+    repo = tmp_path_factory.mktemp("gitmodules") / "myrepo"
+    git = _init_test_repo(repo)
+    (repo / "dummy.txt").write_text("hello")
+    (repo / ".gitmodules").write_text(textwrap.dedent("""\
+        [submodule "raw-data"]
+        \tpath = raw-data
+        \turl = ../raw-data.git
+    """))
+    git.run("add", ".")
+    git.run("commit", "-m", "init")
+    return repo
+
+
 class TestRewriteSubmoduleUrls:
-    def test_rewrites_relative_url(self, tmp_path):
+    def test_rewrites_relative_url(self, materialize_mod, _gitmodules_repo, tmp_path):
         repo = tmp_path / "myrepo"
-        repo.mkdir()
-        subprocess.run(["git", "init", str(repo)], check=True, capture_output=True)
-        subprocess.run(
-            ["git", "-C", str(repo), "config", "user.email", "test@test.com"],
-            check=True,
-            capture_output=True,
-        )
-        subprocess.run(
-            ["git", "-C", str(repo), "config", "user.name", "Test"],
-            check=True,
-            capture_output=True,
-        )
-        (repo / "dummy.txt").write_text("hello")
-        subprocess.run(["git", "-C", str(repo), "add", "."], check=True, capture_output=True)
-        subprocess.run(
-            ["git", "-C", str(repo), "commit", "-m", "init"],
-            check=True,
-            capture_output=True,
-        )
-
+        shutil.copytree(_gitmodules_repo, repo, symlinks=True)
         gitmodules = repo / ".gitmodules"
-        gitmodules.write_text(textwrap.dedent("""\
-            [submodule "raw-data"]
-            \tpath = raw-data
-            \turl = ../raw-data.git
-        """))
-        subprocess.run(
-            ["git", "-C", str(repo), "add", ".gitmodules"],
-            check=True,
-            capture_output=True,
-        )
-        subprocess.run(
-            ["git", "-C", str(repo), "commit", "-m", "add submodule ref"],
-            check=True,
-            capture_output=True,
-        )
 
         materialize_mod.rewrite_submodule_urls(
             repo,
@@ -255,116 +400,147 @@ class TestRewriteSubmoduleUrls:
 # ---------------------------------------------------------------------------
 
 
-def _init_test_repo(path: Path) -> None:
-    """Create a minimal git repo at *path* with content/examples/ dir."""
-    subprocess.run(
-        ["git", "init", "-b", "main", str(path)],
-        check=True,
-        capture_output=True,
-    )
-    subprocess.run(
-        ["git", "-C", str(path), "config", "user.email", "test@test.com"],
-        check=True,
-        capture_output=True,
-    )
-    subprocess.run(
-        ["git", "-C", str(path), "config", "user.name", "Test"],
-        check=True,
+class _Git:
+    """Runs ``git -C cwd ...`` with the defaults used throughout these tests.
+
+    Calls are checked, and stdout is discarded unless the caller captures it;
+    stderr is left to pytest's capturing so failures still show git's message.
+    """
+
+    def __init__(self, cwd: Path) -> None:
+        self._prefix = ("git", "-C", str(cwd))
+
+    def run(self, *args: str, **kwargs) -> subprocess.CompletedProcess:
+        kwargs.setdefault("check", True)
+        if not kwargs.get("capture_output"):
+            kwargs.setdefault("stdout", subprocess.DEVNULL)
+        return subprocess.run((*self._prefix, *args), **kwargs)
+
+
+def _cat_file_batch(git: _Git, requests: list[str]) -> dict[str, bytes]:
+    """Read several ``<rev>:<path>`` objects through *git* in one process.
+
+    Requests naming missing objects are left out of the result.
+    """
+    out = git.run(
+        "cat-file", "--batch",
+        input="".join(f"{r}\n" for r in requests).encode("utf-8"),
         capture_output=True,
-    )
+    ).stdout
+    blobs: dict[str, bytes] = {}
+    pos = 0
+    for request in requests:
+        eol = out.index(b"\n", pos)
+        header = out[pos:eol].split()
+        pos = eol + 1
+        if header[-1] == b"missing":
+            continue
+        size = int(header[2])
+        blobs[request] = out[pos:pos + size]
+        pos += size + 1
+    return blobs
+
+
+def _init_test_repo(path: Path) -> _Git:
+    """Create a minimal git repo at *path* with a test identity configured."""
+    _Git(path.parent).run("init", "-b", "main", str(path))
+    # Append the identity directly instead of spawning `git config` twice.
+    with open(path / ".git" / "config", "a", encoding="utf-8") as f:
+        f.write("[user]\n\temail = test@test.com\n\tname = Test\n")
+    return _Git(path)
+
+
+_MD_TEMPLATE = textwrap.dedent("""\
+    # Test
+
+    ```sh
+    #!/bin/sh
+    # pragma: testrun demo-1
+    # pragma: requires sh git
+    # pragma: materialize myrepo
+    set -eu
+    cd "$(mktemp -d "${TMPDIR:-/tmp}/mat-test-XXXXXXX")"
+    git init myrepo
+    cd myrepo
+    git config user.email "test@test.com"
+    git config user.name "Test"
+    echo "__BODY__" > file.txt
+    git add -A
+    git commit -m "init"
+    ```
+""")
 
 
 def _write_test_md(path: Path, script_body: str = "echo hello") -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(textwrap.dedent(f"""\
-        # Test
-
-        ```sh
-        #!/bin/sh
-        # pragma: testrun demo-1
-        # pragma: requires sh git
-        # pragma: materialize myrepo
-        set -eu
-        cd "$(mktemp -d "${{TMPDIR:-/tmp}}/mat-test-XXXXXXX")"
-        git init myrepo
-        cd myrepo
-        git config user.email "test@test.com"
-        git config user.name "Test"
-        echo "{script_body}" > file.txt
-        git add -A
-        git commit -m "init"
-        ```
-    """))
+    path.write_text(_MD_TEMPLATE.replace("__BODY__", script_body))
+
+
+@pytest.fixture(scope="session")
+def _repo_template(tmp_path_factory) -> Path:
+    """A repo with one committed README, built once per test session."""
+    repo = tmp_path_factory.mktemp("tmpl") / "repo"
+    git = _init_test_repo(repo)
+    # Need an initial commit so git notes work
+    (repo / "README.md").write_text("test")
+    git.run("add", ".")
+    git.run("commit", "-m", "init")
+    return repo
+
+
+@pytest.fixture
+def initialized_repo(_repo_template, tmp_path) -> Path:
+    """A private copy of :func:`_repo_template` at ``tmp_path / "repo"``."""
+    repo = tmp_path / "repo"
+    shutil.copytree(_repo_template, repo, symlinks=True)
+    return repo
+
+
+@pytest.fixture
+def git(initialized_repo) -> _Git:
+    """Runs git in :func:`initialized_repo`."""
+    return _Git(initialized_repo)
 
 
 @pytest.mark.ai_generated
 class TestMaterializeLocalBranch:
     """Test that materialization creates local branches + git notes."""
 
-    def test_creates_local_branch(self, tmp_path, monkeypatch):
-        repo = tmp_path / "repo"
-        _init_test_repo(repo)
+    def test_creates_local_branch(
+        self, materialize_mod, initialized_repo, git, monkeypatch,
+    ):
+        repo = initialized_repo
         content_dir = repo / "content" / "examples"
         _write_test_md(content_dir / "test-example.md")
 
-        # Need an initial commit so git notes work
-        (repo / "README.md").write_text("test")
-        subprocess.run(
-            ["git", "-C", str(repo), "add", "."],
-            check=True, capture_output=True,
-        )
-        subprocess.run(
-            ["git", "-C", str(repo), "commit", "-m", "init"],
-            check=True, capture_output=True,
-        )
-
         monkeypatch.chdir(repo)
         with patch.object(materialize_mod, "CONTENT_DIR", content_dir):
             materialize_mod.main([])
 
         # Branch should exist locally
-        result = subprocess.run(
-            ["git", "-C", str(repo), "rev-parse", "--verify",
-             "refs/heads/examples/test-example/demo-1/myrepo"],
-            capture_output=True,
-        )
-        assert result.returncode == 0, "Local branch was not created"
+        ref = "refs/heads/examples/test-example/demo-1/myrepo"
+        blobs = _cat_file_batch(git, [ref, f"{ref}:file.txt"])
+        assert ref in blobs, "Local branch was not created"
 
         # Branch should contain file.txt
-        result = subprocess.run(
-            ["git", "-C", str(repo), "show",
-             "examples/test-example/demo-1/myrepo:file.txt"],
-            capture_output=True,
-            text=True,
-        )
-        assert result.returncode == 0
-        assert result.stdout.strip() == "echo hello"
+        assert blobs[f"{ref}:file.txt"].strip() == b"echo hello"
 
-    def test_no_marker_commits(self, tmp_path, monkeypatch):
+    def test_no_marker_commits(
+        self, materialize_mod, initialized_repo, git, monkeypatch,
+    ):
         """The example branch should NOT have extra marker commits."""
-        repo = tmp_path / "repo"
-        _init_test_repo(repo)
+        repo = initialized_repo
         content_dir = repo / "content" / "examples"
         _write_test_md(content_dir / "test-example.md")
 
-        (repo / "README.md").write_text("test")
-        subprocess.run(
-            ["git", "-C", str(repo), "add", "."],
-            check=True, capture_output=True,
-        )
-        subprocess.run(
-            ["git", "-C", str(repo), "commit", "-m", "init"],
-            check=True, capture_output=True,
-        )
-
         monkeypatch.chdir(repo)
         with patch.object(materialize_mod, "CONTENT_DIR", content_dir):
             materialize_mod.main([])
 
         # The branch should have exactly 1 commit (the "init" from the script)
-        result = subprocess.run(
-            ["git", "-C", str(repo), "rev-list", "--count",
-             "examples/test-example/demo-1/myrepo"],
+        result = git.run(
+            "rev-list", "--count",
+            "examples/test-example/demo-1/myrepo",
             capture_output=True,
             text=True,
         )
@@ -372,125 +548,91 @@ class TestMaterializeLocalBranch:
             f"Expected 1 commit, got {result.stdout.strip()}"
 
         # And that commit should NOT contain "Script-Hash"
-        result = subprocess.run(
-            ["git", "-C", str(repo), "log", "-1", "--format=%B",
-             "examples/test-example/demo-1/myrepo"],
+        result = git.run(
+            "log", "-1", "--format=%B",
+            "examples/test-example/demo-1/myrepo",
             capture_output=True,
             text=True,
         )
         assert "Script-Hash" not in result.stdout
 
-    def test_hash_stored_in_git_notes(self, tmp_path, monkeypatch):
+    def test_hash_stored_in_git_notes(
+        self, materialize_mod, initialized_repo, git, monkeypatch,
+    ):
         """Script hash should be in a git note, not a commit."""
-        repo = tmp_path / "repo"
-        _init_test_repo(repo)
+        repo = initialized_repo
         content_dir = repo / "content" / "examples"
         _write_test_md(content_dir / "test-example.md")
 
-        (repo / "README.md").write_text("test")
-        subprocess.run(
-            ["git", "-C", str(repo), "add", "."],
-            check=True, capture_output=True,
-        )
-        subprocess.run(
-            ["git", "-C", str(repo), "commit", "-m", "init"],
-            check=True, capture_output=True,
-        )
-
         monkeypatch.chdir(repo)
         with patch.object(materialize_mod, "CONTENT_DIR", content_dir):
             materialize_mod.main([])
 
         # Read the note on the branch tip
-        tip = subprocess.run(
-            ["git", "-C", str(repo), "rev-parse",
-             "refs/heads/examples/test-example/demo-1/myrepo"],
-            capture_output=True, text=True, check=True,
+        tip = git.run(
+            "rev-parse",
+            "refs/heads/examples/test-example/demo-1/myrepo",
+            capture_output=True, text=True,
         )
         commit = tip.stdout.strip()
 
-        note = subprocess.run(
-            ["git", "-C", str(repo), "notes",
-             f"--ref={materialize_mod.NOTES_REF}", "show", commit],
+        note = git.run(
+            "notes",
+            f"--ref={materialize_mod.NOTES_REF}", "show", commit,
             capture_output=True, text=True,
         )
-        assert note.returncode == 0
         assert "Script-Hash:" in note.stdout
 
-    def test_cache_hit_skips_regeneration(self, tmp_path, monkeypatch, capsys):
-        """Second run with same script content should say 'cache hit'."""
-        repo = tmp_path / "repo"
-        _init_test_repo(repo)
-        content_dir = repo / "content" / "examples"
-        _write_test_md(content_dir / "test-example.md")
-
-        (repo / "README.md").write_text("test")
-        subprocess.run(
-            ["git", "-C", str(repo), "add", "."],
-            check=True, capture_output=True,
-        )
-        subprocess.run(
-            ["git", "-C", str(repo), "commit", "-m", "init"],
-            check=True, capture_output=True,
-        )
+    def test_cache_hit_after_materialize(
+        self, materialize_mod, initialized_repo, monkeypatch,
+    ):
+        """The note written by a run marks the same script as cached."""
+        repo = initialized_repo
+        md = repo / "content" / "examples" / "test-example.md"
+        _write_test_md(md)
 
         monkeypatch.chdir(repo)
-        with patch.object(materialize_mod, "CONTENT_DIR", content_dir):
+        with patch.object(materialize_mod, "CONTENT_DIR", md.parent):
             materialize_mod.main([])
-            captured = capsys.readouterr()
-            assert "cache hit" not in captured.out
 
-            # Second run — should hit the cache
-            materialize_mod.main([])
-            captured = capsys.readouterr()
-            assert "cache hit" in captured.out
+        hash_val = materialize_mod.script_hash(next(iter_script_blocks(md)).code)
+        bname = "examples/test-example/demo-1/myrepo"
+        assert materialize_mod._is_cache_hit([bname], hash_val)
+        assert not materialize_mod._is_cache_hit([bname], "0" * 64)
+        assert not materialize_mod._is_cache_hit(
+            [bname, "examples/test-example/demo-1/other"], hash_val,
+        )
 
-    def test_content_change_regenerates(self, tmp_path, monkeypatch):
+    def test_content_change_regenerates(
+        self, materialize_mod, initialized_repo, git, monkeypatch,
+    ):
         """Changing script content should regenerate the branch."""
-        repo = tmp_path / "repo"
-        _init_test_repo(repo)
+        repo = initialized_repo
         content_dir = repo / "content" / "examples"
         md = content_dir / "test-example.md"
 
-        (repo / "README.md").write_text("test")
-        subprocess.run(
-            ["git", "-C", str(repo), "add", "."],
-            check=True, capture_output=True,
-        )
-        subprocess.run(
-            ["git", "-C", str(repo), "commit", "-m", "init"],
-            check=True, capture_output=True,
-        )
-
         monkeypatch.chdir(repo)
+        blob = "examples/test-example/demo-1/myrepo:file.txt"
         with patch.object(materialize_mod, "CONTENT_DIR", content_dir):
             _write_test_md(md, "version1")
             materialize_mod.main([])
 
-            result = subprocess.run(
-                ["git", "-C", str(repo), "show",
-                 "examples/test-example/demo-1/myrepo:file.txt"],
-                capture_output=True, text=True,
-            )
-            assert result.stdout.strip() == "version1"
+            blobs = _cat_file_batch(git, [blob])
+            assert blobs[blob].strip() == b"version1"
 
             # Change content and re-run
             _write_test_md(md, "version2")
             materialize_mod.main([])
 
-            result = subprocess.run(
-                ["git", "-C", str(repo), "show",
-                 "examples/test-example/demo-1/myrepo:file.txt"],
-                capture_output=True, text=True,
-            )
-            assert result.stdout.strip() == "version2"
+            blobs = _cat_file_batch(git, [blob])
+            assert blobs[blob].strip() == b"version2"
 
 
 @pytest.mark.ai_generated
 class TestMaterializeWorktree:
     """The --worktrees-under mode still works."""
 
-    def test_worktree_creation(self, tmp_path):
+    def test_worktree_creation(self, materialize_mod, tmp_path):
         content_dir = tmp_path / "content" / "examples"
         _write_test_md(content_dir / "test-example.md")
 
@@ -504,6 +646,67 @@ class TestMaterializeWorktree:
         assert (expected / "file.txt").exists()
         assert (expected / "file.txt").read_text().strip() == "echo hello"
 
+    def test_sparse_worktree(self, materialize_mod, tmp_path):
+        content_dir = tmp_path / "content" / "examples"
+        _write_test_md(content_dir / "test-example.md")
+        worktrees = tmp_path / "worktrees"
+        expected = worktrees / "examples" / "test-example" / "demo-1" / "myrepo"
+
+        with patch.object(materialize_mod, "CONTENT_DIR", content_dir):
+            materialize_mod.main(
+                ["--worktrees-under", str(worktrees), "--sparse", "/other.txt"]
+            )
+        assert (expected / ".git").is_dir()
+        assert not (expected / "file.txt").exists()
+
+        with patch.object(materialize_mod, "CONTENT_DIR", content_dir):
+            materialize_mod.main(
+                ["--worktrees-under", str(worktrees), "--sparse", "/file.txt"]
+            )
+        assert (expected / "file.txt").read_text().strip() == "echo hello"
+
+    def test_sparse_keeps_branches_and_notes(
+        self, materialize_mod, initialized_repo, git, tmp_path,
+    ):
+        repo = initialized_repo
+        (repo / "other.txt").write_text("kept")
+        git.run("add", "other.txt")
+        git.run("commit", "-m", "other")
+        git.run("branch", "feature")
+        git.run("notes", "add", "-m", "a note", "HEAD")
+        _init_test_repo(repo / "nested")
+
+        materialize_mod.create_worktree(
+            repo, "examples/x", tmp_path / "worktrees", ["/other.txt"],
+        )
+        dest = tmp_path / "worktrees" / "examples" / "x"
+        assert not (dest / "README.md").exists()
+        assert (dest / "other.txt").read_text() == "kept"
+        assert (dest / "nested" / ".git").is_dir()
+        dest_git = _Git(dest)
+        refs = dest_git.run(
+            "for-each-ref", "--format=%(refname)", capture_output=True, text=True,
+        ).stdout.split()
+        assert refs == [
+            "refs/heads/feature", "refs/heads/main", "refs/notes/commits",
+        ]
+        status = dest_git.run(
+            "status", "--porcelain", capture_output=True, text=True,
+        ).stdout
+        assert status == "?? nested/\n"
+
+    def test_sparse_unborn_head(self, materialize_mod, tmp_path):
+        _init_test_repo(tmp_path / "empty")
+        materialize_mod.create_worktree(
+            tmp_path / "empty", "examples/x", tmp_path / "worktrees", ["/a"],
+        )
+        assert (tmp_path / "worktrees" / "examples" / "x" / ".git").is_dir()
+
+    def test_sparse_requires_worktrees_under(self, materialize_mod, capsys):
+        with pytest.raises(SystemExit):
+            materialize_mod.main(["--sparse", "/file.txt"])
+        assert "--sparse requires --worktrees-under" in capsys.readouterr().err
+
 
 # ---------------------------------------------------------------------------
 # Tests for dematerialize_examples
@@ -514,92 +717,97 @@ class TestMaterializeWorktree:
 class TestDematerialize:
     """Test local (and remote) branch deletion."""
 
-    @staticmethod
-    def _setup_repo_with_local_branches(tmp_path: Path) -> Path:
-        """Create a repo with local example branches."""
-        repo = tmp_path / "repo"
-        _init_test_repo(repo)
-        (repo / "README.md").write_text("test")
-        subprocess.run(
-            ["git", "-C", str(repo), "add", "."],
-            check=True, capture_output=True,
-        )
-        subprocess.run(
-            ["git", "-C", str(repo), "commit", "-m", "init"],
-            check=True, capture_output=True,
+    @pytest.fixture
+    def repo(self, initialized_repo, git, dematerialize_mod) -> Path:
+        """A repo with local example branches and a note."""
+        # Create local example branches in a single git invocation
+        git.run(
+            "update-ref", "--stdin",
+            input="".join(
+                f"create refs/heads/{branch} HEAD\n"
+                for branch in [
+                    "examples/test/demo-1/myrepo",
+                    "examples/test/demo-2/myrepo",
+                ]
+            ),
+            text=True,
         )
 
-        # Create local example branches
-        for branch in [
-            "examples/test/demo-1/myrepo",
-            "examples/test/demo-2/myrepo",
-        ]:
-            subprocess.run(
-                ["git", "-C", str(repo), "branch", branch],
-                check=True, capture_output=True,
-            )
-
         # Add a note to one branch tip so we test note pruning
-        tip = subprocess.run(
-            ["git", "-C", str(repo), "rev-parse", "HEAD"],
-            capture_output=True, text=True, check=True,
-        )
-        subprocess.run(
-            ["git", "-C", str(repo), "notes",
-             f"--ref={dematerialize_mod.NOTES_REF}", "add", "-m",
-             "Script-Hash: abc123", tip.stdout.strip()],
-            check=True, capture_output=True,
+        git.run(
+            "notes", f"--ref={dematerialize_mod.NOTES_REF}",
+            "add", "-m", "Script-Hash: abc123", "HEAD",
         )
 
-        return repo
+        return initialized_repo
 
-    def test_list_local_branches(self, tmp_path):
-        repo = self._setup_repo_with_local_branches(tmp_path)
-        result = subprocess.run(
-            ["git", "-C", str(repo), "branch", "--list", "examples/*",
-             "--format=%(refname:short)"],
+    def test_list_local_branches(self, repo, git):
+        result = git.run(
+            "branch", "--list", "examples/*",
+            "--format=%(refname:short)",
             capture_output=True, text=True,
         )
         branches = [b.strip() for b in result.stdout.splitlines() if b.strip()]
         assert len(branches) == 2
         assert "examples/test/demo-1/myrepo" in branches
 
-    def test_dry_run_preserves_branches(self, tmp_path, monkeypatch):
-        repo = self._setup_repo_with_local_branches(tmp_path)
+    def test_dry_run_preserves_branches(
+        self, dematerialize_mod, repo, git, monkeypatch,
+    ):
         monkeypatch.chdir(repo)
 
         dematerialize_mod.main(["--dry-run"])
 
-        result = subprocess.run(
-            ["git", "branch", "--list", "examples/*",
-             "--format=%(refname:short)"],
+        result = git.run(
+            "branch", "--list", "examples/*",
+            "--format=%(refname:short)",
             capture_output=True, text=True,
         )
         branches = [b.strip() for b in result.stdout.splitlines() if b.strip()]
         assert len(branches) == 2
 
-    def test_delete_local_branches(self, tmp_path, monkeypatch):
-        repo = self._setup_repo_with_local_branches(tmp_path)
+    def test_delete_local_branches(self, dematerialize_mod, repo, git, monkeypatch):
         monkeypatch.chdir(repo)
 
         dematerialize_mod.main([])
 
-        result = subprocess.run(
-            ["git", "branch", "--list", "examples/*",
-             "--format=%(refname:short)"],
+        result = git.run(
+            "branch", "--list", "examples/*",
+            "--format=%(refname:short)",
             capture_output=True, text=True,
         )
         branches = [b.strip() for b in result.stdout.splitlines() if b.strip()]
         assert len(branches) == 0
 
-    def test_notes_pruned(self, tmp_path, monkeypatch):
-        repo = self._setup_repo_with_local_branches(tmp_path)
+    def test_notes_pruned(self, dematerialize_mod, repo, git, monkeypatch):
         monkeypatch.chdir(repo)
 
         dematerialize_mod.main([])
 
-        result = subprocess.run(
-            ["git", "notes", f"--ref={dematerialize_mod.NOTES_REF}", "list"],
+        result = git.run(
+            "notes", f"--ref={dematerialize_mod.NOTES_REF}", "list",
             capture_output=True, text=True,
         )
         assert result.stdout.strip() == ""
+
+    def test_delete_remote_branches(
+        self, dematerialize_mod, repo, git, tmp_path, monkeypatch,
+    ):
+        remote = tmp_path / "remote.git"
+        _Git(tmp_path).run("init", "--bare", str(remote))
+        git.run("remote", "add", "origin", str(remote))
+        git.run("push", "origin", "refs/heads/examples/*:refs/heads/examples/*",
+                stderr=subprocess.DEVNULL)
+        monkeypatch.chdir(repo)
+        assert dematerialize_mod.list_remote_example_branches("origin") == [
+            "examples/test/demo-1/myrepo", "examples/test/demo-2/myrepo",
+        ]
+
+        with patch.object(dematerialize_mod, "PUSH_DELETE_BATCH", 1):
+            dematerialize_mod.main(["--remote", "origin"])
+
+        result = _Git(remote).run(
+            "for-each-ref", "refs/heads/examples/",
+            capture_output=True, text=True,
+        )
+        assert result.stdout == ""